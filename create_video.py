@@ -2,10 +2,11 @@ import sys
 import os
 import subprocess
 import asyncio
+import time
 from playwright.async_api import async_playwright
 import mimetypes
 import argparse
-from utils import prewrite_file, HtmlTempManager
+from utils import prewrite_file, HtmlTempManager, ProgressReporter, open_progress_stream, pipe_pending_bytes
 from config import Config
 from urllib.parse import urljoin, urlparse
 
@@ -33,7 +34,7 @@ async def context_routes(route, request):
         await route.continue_()
 
 
-async def main(config: Config, config_path: str, output_path: str):
+async def main(config: Config, config_path: str, output_path: str, progress_stream=None, metrics_file: str|None = None, progress_interval: float = 1.0):
     """
     主函数：生成所有视频帧并输出到 stdout
     """
@@ -97,36 +98,56 @@ async def main(config: Config, config_path: str, output_path: str):
             stderr=sys.stderr
         )
 
-        # --- 帧生成循环 ---
-        for i in range(total_frames):
-
-            # 在浏览器页面上执行 JS 函数来更新帧内容
-            await controller.evaluate('(controller, data) => controller.updateFrame(data.frame, data.frame_rate)', {
-                "frame": i,
-                "frame_rate": FPS
-            })
-            
-            # 截取当前页面，不保存为文件，而是获取其二进制数据
-            screenshot_bytes = await page.screenshot(type="png")
-            
-            try:
-                # 将 PNG 图像的二进制数据写入FFmpeg
-                if ffmpeg_process.stdin:
-                    ffmpeg_process.stdin.write(screenshot_bytes)
-            except BrokenPipeError:
-                # 当 FFmpeg 进程关闭管道时，会发生此错误。
-                print("FFmpeg process exited unexpectedly. Aborting.", file=sys.stderr)
-                break
-            
-            # 在标准错误流中打印进度，避免污染输出管道
-            print(f"Generated frame {i + 1}/{total_frames}", file=sys.stderr)
-
-        await browser.close()
-        print("Frame generation complete.")
-
-        if ffmpeg_process.stdin:
-            ffmpeg_process.stdin.close()
-        ffmpeg_process.wait()
+        reporter = ProgressReporter(
+            total_frames, progress_stream, metrics_file, progress_interval,
+            queue_depth=lambda: pipe_pending_bytes(ffmpeg_process.stdin),
+            labels={"output": os.path.abspath(output_path), "pid": str(os.getpid())},
+        )
+        reporter.start()
+        status = 'ok'
+
+        try:
+            # --- 帧生成循环 ---
+            for i in range(total_frames):
+
+                # 在浏览器页面上执行 JS 函数来更新帧内容
+                await controller.evaluate('(controller, data) => controller.updateFrame(data.frame, data.frame_rate)', {
+                    "frame": i,
+                    "frame_rate": FPS
+                })
+                
+                # 截取当前页面，不保存为文件，而是获取其二进制数据
+                screenshot_bytes = await page.screenshot(type="png")
+                
+                write_start = time.monotonic()
+                try:
+                    # 将 PNG 图像的二进制数据写入FFmpeg
+                    if ffmpeg_process.stdin:
+                        ffmpeg_process.stdin.write(screenshot_bytes)
+                except BrokenPipeError:
+                    # 当 FFmpeg 进程关闭管道时，会发生此错误。
+                    print("FFmpeg process exited unexpectedly. Aborting.", file=sys.stderr)
+                    status = 'ffmpeg_exited'
+                    break
+                
+                # 限速报告进度，避免每帧都写一次
+                # 写入耗时即为被编码器阻塞的时间，可作为背压信号
+                reporter.update(i + 1, len(screenshot_bytes), time.monotonic() - write_start)
+
+            await browser.close()
+            print("Frame generation complete.")
+
+            if ffmpeg_process.stdin:
+                ffmpeg_process.stdin.close()
+            ffmpeg_process.wait()
+            if status == 'ok' and ffmpeg_process.returncode != 0:
+                status = 'ffmpeg_failed'
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            # 出错时也要发出 done 事件，否则编排端无法区分崩溃与卡住
+            reporter.finish(status)
         print("FFmpeg process finished.")
 
 
@@ -136,6 +157,9 @@ def run():
     parser = argparse.ArgumentParser(description='Generate a vertical lyrics video.')
     parser.add_argument('config', type=str, help='Path to the config file.')
     parser.add_argument('output', type=str, help='Path to the output video file. Should end with .mp4')
+    parser.add_argument('-p', '--progress', type=str, default=None, help='Write progress events as JSON lines to this file, or to a file descriptor given as "fd:N". Without it, progress is printed to stderr.')
+    parser.add_argument('--progress-interval', type=float, default=1.0, help='Minimum seconds between two progress reports. Default is 1.0.')
+    parser.add_argument('-M', '--metrics-file', type=str, default=None, help='Also write progress metrics to this file in Prometheus text format, e.g. for the node_exporter textfile collector.')
     # parser.add_argument('-c', '--config', action='store_true', help='Flag to indicate that the input is a config file.')
     args = parser.parse_args()
 
@@ -150,11 +174,27 @@ def run():
         ans = input("Continue? (y/n)")
         if ans.lower() != 'y': return
 
+        # 在启动浏览器和 FFmpeg 之前打开进度输出目标
+        progress_stream = None
+        if args.progress:
+            try:
+                progress_stream = open_progress_stream(args.progress)
+            except (ValueError, OSError) as e:
+                print(f"Cannot open progress target: {e}")
+                return
+
         htm = HtmlTempManager(WEB_FILE_ROOT)
         config_temp = htm.add_temp_file('config.json', con.to_json())
         config_temp_path = urljoin(URL_PREFIX, config_temp['url_path'])
 
-        asyncio.run(main(con, config_temp_path, args.output))
+        try:
+            asyncio.run(main(con, config_temp_path, args.output, progress_stream, args.metrics_file, args.progress_interval))
+        finally:
+            if progress_stream:
+                try:
+                    progress_stream.close()
+                except (OSError, ValueError):
+                    pass
 
     else:
         print("Config file not found.")
@@ -0,0 +1,191 @@
+import io
+import json
+import os
+import stat
+
+import pytest
+
+from utils import ProgressReporter, open_progress_stream
+
+
+def read_events(stream: io.StringIO) -> list[dict]:
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_event_sequence_and_shape():
+    stream = io.StringIO()
+    reporter = ProgressReporter(10, stream, interval=1.0, queue_depth=lambda: 42)
+    reporter.start(now=100.0)
+    for i in range(10):
+        reporter.update(i + 1, 1000, now=100.0 + (i + 1) * 0.5)
+    reporter.finish(now=105.0)
+
+    events = read_events(stream)
+    assert [e['event'] for e in events] == ['start', 'progress', 'progress', 'progress', 'progress', 'progress', 'done']
+    done = events[-1]
+    assert done['status'] == 'ok'
+    assert done['frame'] == 10
+    assert done['total_frames'] == 10
+    assert done['bytes_written'] == 10000
+    assert done['encoder_queue_bytes'] == 42
+    assert done['fps'] == 2.0
+    assert done['eta'] == 0.0
+
+
+def test_interval_throttling():
+    stream = io.StringIO()
+    reporter = ProgressReporter(100, stream, interval=1.0)
+    reporter.start(now=0.0)
+    reporter.update(1, 1, now=0.5)
+    reporter.update(2, 1, now=0.99)
+    reporter.update(3, 1, now=1.0)
+    reporter.update(4, 1, now=1.5)
+    reporter.update(5, 1, now=2.0)
+
+    progress = [e['frame'] for e in read_events(stream) if e['event'] == 'progress']
+    assert progress == [3, 5]
+
+
+def test_fps_and_eta():
+    reporter = ProgressReporter(100, io.StringIO())
+    reporter.start(now=10.0)
+    reporter.update(25, 0, now=15.0)
+    data = reporter.snapshot(now=15.0)
+    assert data['fps'] == 5.0
+    assert data['eta'] == 15.0
+    assert data['encoder_queue_bytes'] is None
+
+
+def test_queue_depth_only_queried_on_emit():
+    calls = []
+    reporter = ProgressReporter(100, io.StringIO(), interval=10.0, queue_depth=lambda: calls.append(1) or 0)
+    reporter.start(now=0.0)
+    for i in range(50):
+        reporter.update(i + 1, 1, now=i * 0.1)
+    assert len(calls) == 1
+
+
+def test_stderr_fallback(capsys):
+    reporter = ProgressReporter(10, interval=1.0)
+    reporter.start(now=0.0)
+    reporter.update(5, 1, now=1.0)
+    assert 'Generated frame 5/10' in capsys.readouterr().err
+
+
+def test_metrics_file(tmp_path):
+    metrics_path = tmp_path / 'metrics.prom'
+    reporter = ProgressReporter(10, io.StringIO(), str(metrics_path), queue_depth=lambda: 7,
+                                labels={"output": 'C:\\out "a".mp4', "pid": '123'})
+    reporter.start(now=0.0)
+    reporter.update(5, 100, 0.25, now=1.0)
+
+    text = metrics_path.read_text(encoding='utf-8')
+    labels = '{output="C:\\\\out \\"a\\".mp4",pid="123"}'
+    assert f'plvm_frames_generated{labels} 5' in text
+    assert f'plvm_frames_target{labels} 10' in text
+    assert f'plvm_bytes_written_total{labels} 100' in text
+    assert f'plvm_encoder_queue_bytes{labels} 7' in text
+    assert f'plvm_encoder_blocked_seconds_total{labels} 0.25' in text
+    assert '# TYPE plvm_bytes_written_total counter' in text
+    assert f'plvm_done{labels} 0' in text
+
+    reporter.finish('error', now=2.0)
+    assert f'plvm_done{labels} 1' in metrics_path.read_text(encoding='utf-8')
+    if os.name != 'nt':
+        assert stat.S_IMODE(os.stat(metrics_path).st_mode) == 0o644
+    assert os.listdir(tmp_path) == ['metrics.prom']
+
+
+def test_open_progress_stream_path(tmp_path):
+    path = tmp_path / 'sub' / 'progress.jsonl'
+    with open_progress_stream(str(path)) as stream:
+        stream.write('x\n')
+    assert path.read_text(encoding='utf-8') == 'x\n'
+
+
+def test_open_progress_stream_fd(tmp_path):
+    path = tmp_path / 'progress.jsonl'
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT)
+    try:
+        with open_progress_stream(f'fd:{fd}') as stream:
+            stream.write('x\n')
+        # closefd=False: 调用方的文件描述符保持打开
+        os.fstat(fd)
+    finally:
+        os.close(fd)
+    assert path.read_text(encoding='utf-8') == 'x\n'
+
+
+@pytest.mark.parametrize('target', ['fd:x', 'fd:', 'fd:-1'])
+def test_open_progress_stream_invalid_fd(target):
+    with pytest.raises(ValueError):
+        open_progress_stream(target)
+
+
+def test_broken_stream_does_not_raise(capsys):
+    read_fd, write_fd = os.pipe()
+    os.close(read_fd)
+    stream = os.fdopen(write_fd, 'w', buffering=1, encoding='utf-8')
+    reporter = ProgressReporter(10, stream, interval=0.0)
+    reporter.start(now=0.0)
+    reporter.update(1, 1, now=1.0)
+    reporter.finish('error', now=2.0)
+
+    err = capsys.readouterr().err
+    assert err.count('progress events disabled') == 1
+    assert 'Generated frame' not in err
+    try:
+        stream.close()
+    except OSError:
+        pass
+
+
+def test_closed_stream_does_not_raise():
+    stream = io.StringIO()
+    stream.close()
+    reporter = ProgressReporter(10, stream)
+    reporter.start(now=0.0)
+    reporter.finish(now=1.0)
+
+
+@pytest.mark.skipif(os.name == 'nt' or os.geteuid() == 0, reason='needs POSIX permissions as a non-root user')
+def test_unwritable_metrics_dir(tmp_path, capsys):
+    metrics_dir = tmp_path / 'metrics'
+    metrics_dir.mkdir()
+    reporter = ProgressReporter(10, io.StringIO(), str(metrics_dir / 'metrics.prom'))
+    metrics_dir.chmod(0o555)
+    try:
+        reporter.start(now=0.0)
+        reporter.update(1, 1, now=1.0)
+        reporter.finish(now=2.0)
+    finally:
+        metrics_dir.chmod(0o755)
+    assert capsys.readouterr().err.count('metrics file disabled') == 1
+    assert os.listdir(metrics_dir) == []
+
+
+def test_failed_metrics_replace_removes_temp_file(tmp_path, monkeypatch, capsys):
+    metrics_path = tmp_path / 'metrics.prom'
+    reporter = ProgressReporter(10, io.StringIO(), str(metrics_path))
+
+    def fail_replace(src, dst):
+        raise PermissionError('file in use')
+    monkeypatch.setattr(os, 'replace', fail_replace)
+    reporter.start(now=0.0)
+    reporter.finish(now=1.0)
+
+    assert capsys.readouterr().err.count('metrics file disabled') == 1
+    assert os.listdir(tmp_path) == []
+
+
+def test_metrics_dir_replaced_by_file(tmp_path, capsys):
+    metrics_dir = tmp_path / 'metrics'
+    metrics_dir.mkdir()
+    reporter = ProgressReporter(10, io.StringIO(), str(metrics_dir / 'metrics.prom'))
+    metrics_dir.rmdir()
+    metrics_dir.write_text('')
+    reporter.start(now=0.0)
+    reporter.finish(now=1.0)
+
+    assert capsys.readouterr().err.count('metrics file disabled') == 1
+    assert os.listdir(tmp_path) == ['metrics']
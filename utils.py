@@ -5,6 +5,15 @@ import json
 import time
 from typing import TypedDict
 import atexit
+import tempfile
+from typing import Callable
+try:
+    import fcntl
+    import termios
+    import struct
+except ImportError:
+    # Windows 等平台不支持 FIONREAD, 此时不报告编码器队列深度
+    fcntl = None
 
 def prewrite_file(path: str) -> None:
     path = os.path.abspath(path)
@@ -144,4 +153,164 @@ class HtmlTempManager:
         for id in list(self.temp_files.keys()):
             self.remove_temp_file(id)
         return
-    
\ No newline at end of file
+    
+
+def open_progress_stream(target: str):
+    """
+    打开进度事件的输出目标. 
+
+    :param target: 文件路径, 或 'fd:N' 形式的文件描述符
+    :return: 一个以行缓冲方式写入的文本流
+    :raises ValueError: 'fd:N' 中的 N 不是非负整数
+    :raises OSError: 文件或文件描述符无法打开
+    """
+    if target.startswith('fd:'):
+        fd = target[3:]
+        if not fd.isdigit():
+            raise ValueError(f'Invalid file descriptor: {target!r}. Expected "fd:N".')
+        return os.fdopen(int(fd), 'w', buffering=1, encoding='utf-8', closefd=False)
+    prewrite_file(target)
+    return open(target, 'w', buffering=1, encoding='utf-8')
+
+def pipe_pending_bytes(pipe) -> int|None:
+    """
+    查询管道中尚未被读取的字节数. 
+    该值只统计内核管道缓冲区 (Linux 默认 64 KiB), 而一帧 PNG 通常有数 MB, 
+    因此结果基本只会是 0 或接近管道容量, 只能粗略反映编码器是否积压; 
+    更可靠的背压信号见 ProgressReporter 的 blocked_seconds. 
+    不支持的平台上返回 None. 
+    """
+    if fcntl is None: return None
+    try:
+        buf = fcntl.ioctl(pipe.fileno(), termios.FIONREAD, b'\0' * 4)
+        return struct.unpack('i', buf)[0]
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class ProgressReporter:
+    """
+    限速的进度报告器. 
+
+    每隔 interval 秒最多输出一次进度, 以 JSON Lines 写入 stream; 
+    未指定 stream 时改为向 stderr 打印一行可读的进度. 
+    如指定 metrics_path, 同时以 Prometheus 文本格式覆盖写入该文件, 
+    labels 用于区分同一台机器上的多个进程. 
+    queue_depth 仅在实际输出时调用, 用于查询编码器管道中缓冲的字节数. 
+    写入 stream 或 metrics 失败时只警告一次并停用该输出, 不会中断渲染. 
+    """
+    METRIC_PREFIX = 'plvm'
+
+    def __init__(self, total_frames: int, stream=None, metrics_path: str|None = None, interval: float = 1.0,
+                 queue_depth: Callable[[], int|None]|None = None, labels: dict[str, str]|None = None):
+        self.total_frames = total_frames
+        self.stream = stream
+        self.metrics_path = metrics_path
+        self.interval = interval
+        self.queue_depth = queue_depth
+        self.labels = labels or {}
+        self.frame = 0
+        self.bytes_written = 0
+        self.blocked_seconds = 0.0
+        self._start_time = time.monotonic()
+        self._last_emit = None
+        self._stream_disabled = False
+        if metrics_path: prewrite_file(metrics_path)
+
+    def start(self, now: float|None = None) -> None:
+        if now is None: now = time.monotonic()
+        self._start_time = now
+        self._emit('start', now)
+
+    def update(self, frame: int, bytes_written: int, blocked_seconds: float = 0.0, now: float|None = None) -> None:
+        """
+        :param blocked_seconds: 本帧写入编码器时阻塞的秒数, 用于反映编码器背压
+        """
+        self.frame = frame
+        self.bytes_written += bytes_written
+        self.blocked_seconds += blocked_seconds
+        if now is None: now = time.monotonic()
+        if self._last_emit is not None and now - self._last_emit < self.interval: return
+        self._emit('progress', now)
+
+    def finish(self, status: str = 'ok', now: float|None = None) -> None:
+        self._emit('done', now, status)
+
+    def snapshot(self, now: float|None = None) -> dict:
+        if now is None: now = time.monotonic()
+        elapsed = now - self._start_time
+        fps = self.frame / elapsed if elapsed > 0 else 0.0
+        remaining = self.total_frames - self.frame
+        eta = remaining / fps if fps > 0 else None
+        return {
+            "frame": self.frame,
+            "total_frames": self.total_frames,
+            "fps": round(fps, 3),
+            "elapsed": round(elapsed, 3),
+            "eta": round(eta, 3) if eta is not None else None,
+            "encoder_queue_bytes": self.queue_depth() if self.queue_depth else None,
+            "encoder_blocked_seconds": round(self.blocked_seconds, 3),
+            "bytes_written": self.bytes_written,
+        }
+
+    def _emit(self, event: str, now: float|None = None, status: str|None = None) -> None:
+        if now is None: now = time.monotonic()
+        self._last_emit = now
+        data = self.snapshot(now)
+        if self.stream:
+            record = {"event": event, "time": time.time(), **data}
+            if status: record['status'] = status
+            try:
+                self.stream.write(json.dumps(record) + '\n')
+            except (OSError, ValueError) as e:
+                # 进度输出失败 (如读端已关闭, 磁盘已满) 不应中断渲染
+                print(f"Warning: failed to write progress, progress events disabled: {e}", file=sys.stderr)
+                self.stream = None
+                self._stream_disabled = True
+        elif event != 'start' and not self._stream_disabled:
+            eta = f"{data['eta']:.0f}s" if data['eta'] is not None else '-'
+            print(f"Generated frame {data['frame']}/{data['total_frames']} ({data['fps']:.1f} fps, ETA {eta})", file=sys.stderr)
+        if self.metrics_path:
+            try:
+                self._write_metrics(data, done=event == 'done')
+            except (OSError, ValueError) as e:
+                print(f"Warning: failed to write metrics, metrics file disabled: {e}", file=sys.stderr)
+                self.metrics_path = None
+
+    def _write_metrics(self, data: dict, done: bool) -> None:
+        p = self.METRIC_PREFIX
+        labels = ','.join(f'{key}="{escape_label_value(str(value))}"' for key, value in self.labels.items())
+        if labels: labels = '{' + labels + '}'
+        metrics = [
+            ('frames_generated', 'gauge', 'Frames rendered and sent to the encoder.', data['frame']),
+            ('frames_target', 'gauge', 'Number of frames the video will have.', data['total_frames']),
+            ('fps', 'gauge', 'Average rendering speed in frames per second.', data['fps']),
+            ('eta_seconds', 'gauge', 'Estimated seconds until all frames are rendered.', data['eta']),
+            ('encoder_queue_bytes', 'gauge', 'Bytes buffered in the encoder stdin pipe, capped by pipe capacity.', data['encoder_queue_bytes']),
+            ('encoder_blocked_seconds_total', 'counter', 'Seconds spent blocked writing frames to the encoder.', data['encoder_blocked_seconds']),
+            ('bytes_written_total', 'counter', 'Bytes written to the encoder.', data['bytes_written']),
+            ('done', 'gauge', 'Whether frame generation has finished.', int(done)),
+        ]
+        lines = []
+        for name, kind, help_text, value in metrics:
+            if value is None: continue
+            lines.append(f'# HELP {p}_{name} {help_text}')
+            lines.append(f'# TYPE {p}_{name} {kind}')
+            lines.append(f'{p}_{name}{labels} {value}')
+        # 先写临时文件再替换, 避免采集端读到写了一半的文件
+        dir = os.path.dirname(os.path.abspath(self.metrics_path))
+        fd, temp_path = tempfile.mkstemp(dir=dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            # mkstemp 创建的文件权限为 0600, 采集端通常以其他用户运行, 需放开读权限
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.metrics_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise